@@ -1,7 +1,11 @@
+import hashlib
+import io
 import streamlit as st
 from PIL import Image
 import numpy as np
+import tensorflow as tf
 import sqlite3
+import threading
 from datetime import datetime
 from tensorflow.keras.models import load_model
 
@@ -50,15 +54,31 @@ st.markdown("""
 # --- Load the Trained Model ---
 @st.cache_resource
 def load_trained_model():
-    return load_model("best_mobilenet_model.h5")
+    return load_model("best_mobilenet_model.h5", compile=False)
 
-model = load_trained_model()
+@st.cache_resource
+def load_classifier():
+    model = load_trained_model()
+
+    @tf.function(input_signature=[tf.TensorSpec([1, 224, 224, 3], tf.float32)])
+    def classify(img_batch):
+        return model(img_batch, training=False)
+
+    return classify
+
+classify = load_classifier()
 
 # --- Initialize SQLite Database ---
-def init_db():
-    conn = sqlite3.connect('patients.db')
-    cursor = conn.cursor()
-    cursor.execute('''CREATE TABLE IF NOT EXISTS patients (
+# One connection is shared by every session thread; the lock serializes
+# access to it, as sqlite3 requires for check_same_thread=False.
+@st.cache_resource
+def get_db():
+    conn = sqlite3.connect('patients.db', check_same_thread=False)
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("PRAGMA synchronous=NORMAL")
+    conn.execute("PRAGMA temp_store=MEMORY")
+    with conn:
+        conn.execute('''CREATE TABLE IF NOT EXISTS patients (
                         patient_id TEXT PRIMARY KEY,
                         name TEXT,
                         age INTEGER,
@@ -66,36 +86,35 @@ def init_db():
                         confidence REAL,
                         last_update TEXT
                     )''')
-    conn.commit()
-    conn.close()
+    return conn, threading.Lock()
 
 def get_patient_record(patient_id):
-    conn = sqlite3.connect('patients.db')
-    cursor = conn.cursor()
-    cursor.execute("SELECT * FROM patients WHERE patient_id = ?", (patient_id,))
-    record = cursor.fetchone()
-    conn.close()
-    return record
+    conn, lock = get_db()
+    with lock:
+        return conn.execute("SELECT * FROM patients WHERE patient_id = ?", (patient_id,)).fetchone()
 
 def update_patient_record(patient_id, name, age, prediction, confidence):
-    conn = sqlite3.connect('patients.db')
-    cursor = conn.cursor()
     now = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-    cursor.execute('''INSERT OR REPLACE INTO patients 
+    conn, lock = get_db()
+    with lock, conn:
+        conn.execute('''INSERT OR REPLACE INTO patients 
                       (patient_id, name, age, last_prediction, confidence, last_update) 
                       VALUES (?, ?, ?, ?, ?, ?)''', 
-                   (patient_id, name, age, prediction, confidence, now))
-    conn.commit()
-    conn.close()
-
-init_db()
+                     (patient_id, name, age, prediction, confidence, now))
 
 # --- Preprocess Uploaded Image ---
 def preprocess_image(image_file):
-    img = image_file.resize((224, 224))  
-    img_array = np.array(img) / 255.0    
-    img_array = np.expand_dims(img_array, axis=0)  
-    return img_array
+    img = image_file.resize((224, 224))
+    img_array = np.asarray(img, dtype=np.float32)
+    img_array *= np.float32(1.0 / 255.0)
+    return img_array[None, ...]
+
+@st.cache_data(show_spinner=False, max_entries=16)
+def load_uploaded_image(raw_bytes):
+    img = Image.open(io.BytesIO(raw_bytes))
+    if img.mode != "RGB":
+        img = img.convert("RGB")
+    return img, preprocess_image(img)
 
 # --- Custom Title and Description ---
 st.markdown("""
@@ -165,21 +184,39 @@ else:
     uploaded_file = st.file_uploader("Upload an Ultrasound Image", type=["jpg", "jpeg", "png"])
 
     if uploaded_file and patient_id and patient_name:
-        img = Image.open(uploaded_file).convert("RGB")
+        raw_bytes = uploaded_file.getvalue()
+        img, processed_img = load_uploaded_image(raw_bytes)
         st.image(img, caption="Uploaded Ultrasound Image", use_container_width=True)
 
         st.markdown("---")
 
         if 18 <= patient_age <= 45:
-            if st.button("Analyze Image"):
-                st.subheader("AI Diagnostic Result")
+            # Keep the latest analysis for this patient, age and image so reruns
+            # triggered by other widgets don't drop it or re-run the model.
+            image_digest = hashlib.blake2b(raw_bytes, digest_size=16).hexdigest()
+            analysis_key = f"analysis_{patient_id}_{int(patient_age)}_{image_digest}"
+            for stale_key in [k for k in st.session_state if k.startswith("analysis_") and k != analysis_key]:
+                del st.session_state[stale_key]
 
-                processed_img = preprocess_image(img)
-                prediction = model.predict(processed_img)
-                result = "PCOS Detected" if prediction[0][0] > 0.5 else "No PCOS Detected"
-                confidence = prediction[0][0] * 100
+            if st.button("Analyze Image"):
+                analysis = st.session_state.get(analysis_key)
+                if analysis is None:
+                    prediction = classify(processed_img).numpy()
+                    analysis = {
+                        "result": "PCOS Detected" if prediction[0][0] > 0.5 else "No PCOS Detected",
+                        "confidence": float(prediction[0][0]) * 100,
+                        "prev_record": prev_record,
+                    }
+                update_patient_record(patient_id, patient_name, patient_age, analysis["result"], analysis["confidence"])
+                st.session_state[analysis_key] = analysis
+
+            if analysis_key in st.session_state:
+                analysis = st.session_state[analysis_key]
+                result = analysis["result"]
+                confidence = analysis["confidence"]
+                prev_record = analysis["prev_record"]
 
-                update_patient_record(patient_id, patient_name, patient_age, result, confidence)
+                st.subheader("AI Diagnostic Result")
 
                 st.success(f"**{result}** for **{patient_name}**, Age: **{int(patient_age)}**.")
                 st.info(f"*Model Confidence: {confidence:.2f}%*")